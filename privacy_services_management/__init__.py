@@ -1,3 +1,3 @@
-import universal
+from . import universal
 
 __version__ = universal.attributes['version']
@@ -1,15 +1,33 @@
 import os
+import re
 import subprocess
-import universal
 
 try:
     from management_tools.plist_editor import PlistEditor
-    from management_tools.app_info import AppInfo
 except ImportError as e:
     print("You need version 1.6.0 or greater of the 'Management Tools' module to be installed first.")
     print("https://github.com/univ-of-utah-marriott-library-apple/management_tools")
     raise e
 
+# The major Darwin version of the running system. It can't change while we're
+# running, so it is only determined once. (0 means it couldn't be found.)
+try:
+    _darwin_version = int(os.uname()[2].split('.')[0])
+except:
+    _darwin_version = 0
+
+# The hardware UUID can't change while we're running, so it is only looked up
+# once. (See get_uuid().)
+_uuid = None
+
+# Unwanted output from the commands run here is discarded into this. Python 2
+# has no subprocess.DEVNULL, so there it is opened the first time it's needed,
+# and only once. (See LSEdit.__dict_update().)
+_devnull = getattr(subprocess, 'DEVNULL', None)
+
+# The global locationd plists are named for (part of) the hardware UUID.
+_global_plist_name = re.compile(r'^com\.apple\.locationd\.([^.]+)\.plist$')
+
 class LSEdit(object):
     """
     Provides a class for modifying the Location Services permissions. This class
@@ -38,17 +56,16 @@ class LSEdit(object):
 
         # Check the version of OS X before continuing; only Darwin versions 10
         # and above support the location services system.
-        try:
-            version = int(os.uname()[2].split('.')[0])
-        except:
+        version = _darwin_version
+        if not version:
             raise RuntimeError("Could not acquire the OS X version.")
         if version < 10:
             raise RuntimeError("Location Services is not supported in this version of OS X.")
         self.version = version
 
-        # Disable the locationd launchd item. (Changes will not be properly
-        # cached if this is not done.)
-        self.__disable()
+        # The locationd launchd item is only disabled once something is
+        # actually about to be modified. (See __prepare().)
+        self.dirty = False
         # This is where the applications' authorizations are stored.
         self.plist = PlistEditor('/var/db/locationd/clients')
         self.logger.info("Modifying service 'location' at '{}'.".format(self.plist.path))
@@ -63,15 +80,31 @@ class LSEdit(object):
         # Services system.
         if not target:
             self.logger.info("Enabling service 'location' globally.")
+            self.__prepare()
             enable_global(True, self.logger)
             self.logger.info("Globally enabled successfully.")
             return
+
+        self.__prepare()
         
         # If we're in admin mode, we can't look up the application as a bundle.
         if self.no_check:
-            self.__insert_executable(target)
+            # Verbosity!
+            self.logger.info("Inserting executable '{}' into service 'location'...".format(target))
+            if self.__write_executable(target, True):
+                # There was an error.
+                raise RuntimeError("Failed to insert executable {}.".format(target))
         else:
-            self.__insert_app(target)
+            # Get the AppInfo object for more information.
+            from management_tools.app_info import AppInfo
+            app = AppInfo(target)
+
+            # Verbosity!
+            self.logger.info("Inserting '{}' into service 'location'...".format(app.bid))
+            if self.__write_app(app, True):
+                # Clearly there was an error...
+                raise RuntimeError("Failed to insert {}.".format(app.name))
+        self.logger.info("Inserted successfully.")
 
     def remove(self, target):
         """
@@ -84,16 +117,21 @@ class LSEdit(object):
         # Services system.
         if not target:
             self.logger.info("Disabling service 'location' globally...")
+            self.__prepare()
             enable_global(False, self.logger)
             self.logger.info("Globally disabled successfully.")
             return
+
+        self.__prepare()
         
         if self.no_check:
             name   = target
             target = 'com.apple.locationd.executable-{}'.format(target)
         else:
-            name   = AppInfo(target).name
-            target = AppInfo(target).bid
+            from management_tools.app_info import AppInfo
+            app    = AppInfo(target)
+            name   = app.name
+            target = app.bid
 
         # Verbosity
         self.logger.info("Removing '{}' from service 'location'...".format(target))
@@ -116,68 +154,86 @@ class LSEdit(object):
         # Services system.
         if not target:
             self.logger.info("Disabling service 'location' globally...")
+            self.__prepare()
             enable_global(False, self.logger)
             self.logger.info("Globally disabled successfully.")
             return
 
+        self.__prepare()
+
+        present = False
         if self.no_check:
             name   = target
-            target = 'com.apple.locationd.executable-{}'.format(target)
+            key    = 'com.apple.locationd.executable-{}'.format(target)
+            present = bool(self.plist.read(key))
         else:
-            name   = AppInfo(target).name
-            target = AppInfo(target).bid
+            # If the target is a bundle identifier that already has an entry in
+            # the plist, there's no need to look up the application at all.
+            tried = '.' in target and '/' not in target
+            if tried:
+                present = bool(self.plist.read(target))
+            if present:
+                name   = target
+                key    = target
+            else:
+                from management_tools.app_info import AppInfo
+                app    = AppInfo(target)
+                name   = app.name
+                key    = app.bid
+                # Don't read the same key twice.
+                if not tried or key != target:
+                    present = bool(self.plist.read(key))
 
         # Verboseness
-        self.logger.info("Disabling '{}' in service 'location'...".format(target))
-
-        # If the application isn't already in locationd, add it.
-        if not self.plist.read(target):
-            self.insert(target)
-
-        # Then deauthorize the application.
-        result = self.plist.dict_add(target, "Authorized", "FALSE", "bool")
+        self.logger.info("Disabling '{}' in service 'location'...".format(key))
+
+        # An existing entry only needs to be deauthorized. Otherwise, the whole
+        # entry is written in one go, already deauthorized.
+        if present:
+            result = self.plist.dict_add(key, "Authorized", "FALSE", "bool")
+        elif self.no_check:
+            result = self.__write_executable(target, False)
+        else:
+            result = self.__write_app(app, False)
         if result:
             raise RuntimeError("Failed to disable {}.".format(name))
         self.logger.info("Disabled successfully.")
 
-    def __insert_app(self, target):
-        """
-        Inserts the specified target application into the locationd plist.
+    def __write_app(self, app, authorized):
         """
-        # Get the AppInfo object for more information.
-        app = AppInfo(target)
-
-        # Verbosity!
-        self.logger.info("Inserting '{}' into service 'location'...".format(app.bid))
+        Writes a complete entry for the application into the locationd plist.
 
+        :param app: the AppInfo object for the application
+        :param authorized: whether the application may use Location Services
+        :return: non-zero if the entry could not be written
+        """
         # This is used for... something. Don't know what, but it's necessary.
         requirement = ("identifier \"{}\" and anchor {}".format(
             app.bid, app.bid.split('.')[1]
         ))
 
         # Write the changes to the locationd plist.
-        result = 0
-        result += self.plist.dict_add(app.bid, "Authorized", "TRUE", "bool")
-        result += self.plist.dict_add(app.bid, "BundleID", app.bid)
-        result += self.plist.dict_add(app.bid, "BundleId", app.bid)
-        result += self.plist.dict_add(app.bid, "BundlePath", app.path)
-        result += self.plist.dict_add(app.bid, "Executable", app.executable)
-        result += self.plist.dict_add(app.bid, "Registered", app.executable)
-        result += self.plist.dict_add(app.bid, "Hide", 0, "int")
-        result += self.plist.dict_add(app.bid, "Requirement", requirement)
-        result += self.plist.dict_add(app.bid, "Whitelisted", "FALSE", "bool")
-        if result:
-            # Clearly there was an error...
-            raise RuntimeError("Failed to insert {}.".format(app.name))
-        self.logger.info("Inserted successfully.")
-
-    def __insert_executable(self, target):
+        return self.__dict_update(app.bid, [
+            ("Authorized",  "TRUE" if authorized else "FALSE", "bool"),
+            ("BundleID",    app.bid,        None),
+            ("BundleId",    app.bid,        None),
+            ("BundlePath",  app.path,       None),
+            ("Executable",  app.executable, None),
+            ("Registered",  app.executable, None),
+            ("Hide",        0,              "int"),
+            ("Requirement", requirement,    None),
+            ("Whitelisted", "FALSE",        "bool"),
+        ])
+
+    def __write_executable(self, target, authorized):
         """
-        Inserts the specified target executable into the locationd plist.
+        Writes a complete entry for the target executable into the locationd
+        plist.
+
+        :param target: the path to the executable
+        :param authorized: whether the executable may use Location Services
+        :return: non-zero if the entry could not be written
         """
-        # Verbosity!
-        self.logger.info("Inserting executable '{}' into service 'location'...".format(target))
-        
         # Reformat the target name.
         key = 'com.apple.locationd.executable-{}'.format(target)
         
@@ -187,7 +243,8 @@ class LSEdit(object):
         try:
             codesign = subprocess.check_output(
                 ['/usr/bin/codesign', '--display', '--verbose=4', target],
-                stderr=subprocess.STDOUT
+                stderr=subprocess.STDOUT,
+                universal_newlines=True
             ).split('\n')
         except subprocess.CalledProcessError:
             self.logger.warn("Executable '{}' is not signed. Adding anyway...".format(target))
@@ -207,20 +264,48 @@ class LSEdit(object):
             requirement = None
         
         # Write the changes to the locationd plist.
-        result = 0
-        result += self.plist.dict_add(key, "Authorized", "TRUE", "bool")
-        result += self.plist.dict_add(key, "BundleID", key)
-        result += self.plist.dict_add(key, "BundleId", key)
-        result += self.plist.dict_add(key, "Executable", target)
-        result += self.plist.dict_add(key, "Registered", target)
-        result += self.plist.dict_add(key, "Hide", 0, "int")
+        entries = [
+            ("Authorized",  "TRUE" if authorized else "FALSE", "bool"),
+            ("BundleID",    key,     None),
+            ("BundleId",    key,     None),
+            ("Executable",  target,  None),
+            ("Registered",  target,  None),
+            ("Hide",        0,       "int"),
+            ("Whitelisted", "FALSE", "bool"),
+        ]
         if requirement:
-            result += self.plist.dict_add(key, "Requirement", requirement)
-        result += self.plist.dict_add(key, "Whitelisted", "FALSE", "bool")
-        if result:
-            # There was an error.
-            raise RuntimeError("Failed to insert executable {}.".format(target))
-        self.logger.info("Inserted successfully.")
+            entries.append(("Requirement", requirement, None))
+        return self.__dict_update(key, entries)
+
+    def __dict_update(self, key, entries):
+        """
+        Adds several entries to the dictionary at 'key' in the locationd plist.
+        All of the entries are written by a single `defaults` invocation, so the
+        plist is only read and rewritten once no matter how many there are.
+
+        :param key: the top-level key of the dictionary to modify
+        :param entries: a list of (subkey, value, type) tuples, where a type of
+                        None means the value is written as a string
+        :return: the exit status of the `defaults` command
+        """
+        # `defaults` wants the domain without the '.plist' extension.
+        domain = self.plist.path
+        if domain.endswith('.plist'):
+            domain = domain[:-len('.plist')]
+
+        command = ['/usr/bin/defaults', 'write', domain, key, '-dict-add']
+        for subkey, value, type in entries:
+            command.extend([subkey, '-' + (type or 'string'), str(value)])
+
+        global _devnull
+        if _devnull is None:
+            _devnull = open(os.devnull, 'w')
+
+        return subprocess.call(
+            command,
+            stderr=subprocess.STDOUT,
+            stdout=_devnull
+        )
 
     def __enter__(self):
         """
@@ -232,8 +317,21 @@ class LSEdit(object):
         """
         Allows for the LSEdit object to be used in a 'with' clause.
         """
-        # Make sure that the locationd launchd item is reactivated.
-        self.__enable()
+        # Make sure that the locationd launchd item is reactivated, if it was
+        # ever disabled.
+        if self.dirty:
+            self.__enable()
+
+    def __prepare(self):
+        """
+        Disables the locationd system before the first change is made, whether
+        to an application's authorization or globally. (Changes will not be
+        properly cached if this is not done.) Sessions which never make a change
+        don't have to stop and restart locationd at all.
+        """
+        if not self.dirty:
+            self.__disable()
+            self.dirty = True
 
     def __enable(self):
         """
@@ -261,38 +359,32 @@ def enable_global(enable, logger):
     uuid = get_uuid()
     ls_dir = '/var/db/locationd/Library/Preferences/ByHost/'
     ls_plist = ls_dir + 'com.apple.locationd.' + str(uuid) + '.plist'
-    logger.info("Modifying global values in '" + ls_plist + "'.")
+    logger.info("Modifying global values in '{}'.".format(ls_plist))
 
     # Depending on settings, there may be a few possible files to use as the
     # locationd plist.
     if not os.path.isfile(ls_plist):
         ls_plist = None
-        # Find everything starting with 'com.apple.locationd' and ending with
-        # the '.plist' extension.
+        # Find everything of the form 'com.apple.locationd.<id>.plist' (where
+        # the id has no further dots in it) and keep the id.
         potentials = [
-            x.lstrip('com.apple.locationd.').rstrip('.plist')
-            for x in os.listdir(ls_dir)
-            if str(x).endswith('.plist')
-            and str(x).startswith('com.apple.locationd.')
+            match.group(1)
+            for match in map(_global_plist_name.match, os.listdir(ls_dir))
+            if match
         ]
-        potentials = [x for x in potentials if not x.find('.') >= 0]
         
         # Must handle things differently depending on the number of results.
         if len(potentials) > 1:
-            # Out of all the matches, try to find the one that matches the UUID.
+            # Out of all the matches, try to find the one that matches the UUID
+            # (or one of its parts) in any case.
+            parts = [uuid] + uuid.split('-')
+            variants = set(parts)
+            variants.update(x.lower() for x in parts)
+            variants.update(x.upper() for x in parts)
             for id in potentials:
-                if uuid == id or uuid.lower() == id or uuid.upper() == id:
+                if id in variants or id.lower() in variants:
                     ls_plist = ('{}com.apple.locationd.{}.plist'.format(ls_dir, id))
                     break
-                
-                for part in uuid.split('-'):
-                    if part == id or part.lower() == id or part.upper() == id:
-                        ls_plist = ('{}com.apple.locationd.{}.plist'.format(ls_dir, id))
-                        break
-                
-                # If we've found it, break out of this loop.
-                if ls_plist:
-                    break
         elif len(potentials) == 1:
             # Only one result - that's easy!
             ls_plist = (ls_dir + 'com.apple.locationd.{}.plist'.format(potentials[0]))
@@ -310,40 +402,85 @@ def enable_global(enable, logger):
 def get_uuid():
     """
     Acquire the Universally Unique Identifier of the hardware.
-    """
-    ioreg = [
-        '/usr/sbin/ioreg',
-        '-rd1',
-        '-c',
-        'IOPlatformExpertDevice'
-    ]
 
-    uuid = subprocess.check_output(ioreg, stderr=subprocess.STDOUT).split('\n')
-    uuid = [x for x in uuid if x.find('UUID') >= 0]
+    The value is read straight out of the I/O Registry through IOKit, which
+    avoids spawning `ioreg` and parsing its (rather large) output. The result
+    is cached for the life of the process.
+    """
+    global _uuid
+    if _uuid is not None:
+        return _uuid
+
+    import ctypes
+
+    iokit = ctypes.CDLL('/System/Library/Frameworks/IOKit.framework/IOKit')
+    cf    = ctypes.CDLL('/System/Library/Frameworks/CoreFoundation.framework/CoreFoundation')
+
+    # Mach ports and registry entries are plain 32-bit integers; everything
+    # from CoreFoundation is an opaque pointer.
+    iokit.IOServiceMatching.restype                = ctypes.c_void_p
+    iokit.IOServiceMatching.argtypes               = [ctypes.c_char_p]
+    iokit.IOServiceGetMatchingService.restype      = ctypes.c_uint32
+    iokit.IOServiceGetMatchingService.argtypes     = [ctypes.c_uint32, ctypes.c_void_p]
+    iokit.IORegistryEntryCreateCFProperty.restype  = ctypes.c_void_p
+    iokit.IORegistryEntryCreateCFProperty.argtypes = [ctypes.c_uint32, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint32]
+    iokit.IOObjectRelease.argtypes                 = [ctypes.c_uint32]
+    cf.CFStringCreateWithCString.restype           = ctypes.c_void_p
+    cf.CFStringCreateWithCString.argtypes          = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_uint32]
+    cf.CFStringGetCString.restype                  = ctypes.c_bool
+    cf.CFStringGetCString.argtypes                 = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_long, ctypes.c_uint32]
+    cf.CFRelease.argtypes                          = [ctypes.c_void_p]
+
+    # kIOMasterPortDefault is MACH_PORT_NULL.
+    master_port = 0
+    utf8        = 0x08000100
+
+    # The matching dictionary is consumed by IOServiceGetMatchingService.
+    matching = iokit.IOServiceMatching(b'IOPlatformExpertDevice')
+    service = iokit.IOServiceGetMatchingService(master_port, matching)
+    if not service:
+        raise RuntimeError("Could not find the platform expert device.")
+
+    try:
+        key = cf.CFStringCreateWithCString(None, b'IOPlatformUUID', utf8)
+        try:
+            value = iokit.IORegistryEntryCreateCFProperty(service, key, None, 0)
+        finally:
+            cf.CFRelease(key)
+    finally:
+        iokit.IOObjectRelease(service)
 
-    if len(uuid) != 1:
+    if not value:
         raise RuntimeError("Could not find a unique UUID.")
 
-    return uuid[0].lstrip().rstrip('"').split('= "')[1]
+    try:
+        raw = ctypes.create_string_buffer(64)
+        if not cf.CFStringGetCString(value, raw, len(raw), utf8):
+            raise RuntimeError("Could not read the hardware UUID.")
+    finally:
+        cf.CFRelease(value)
+
+    _uuid = raw.value.decode('utf-8')
+    return _uuid
 
 def enable():
     """
     Fix permissions for the _locationd user, then load the locationd launchd
     daemon item.
     """
-    chown = [
-        '/usr/sbin/chown',
-        '-R',
-        '_locationd:_locationd',
-        '/var/db/locationd'
-    ]
-
-    result = subprocess.call(
-        chown,
-        stderr=subprocess.STDOUT,
-        stdout=open(os.devnull, 'w')
-    )
-    if result != 0:
+    # Only re-own the files whose ownership is actually wrong (usually none or
+    # just the plist that was edited), instead of rewriting every file in the
+    # tree the way `chown -R` does.
+    from grp import getgrnam
+    from pwd import getpwnam
+    try:
+        uid = getpwnam('_locationd').pw_uid
+        gid = getgrnam('_locationd').gr_gid
+        for path in _tree('/var/db/locationd'):
+            info = os.lstat(path)
+            if info.st_uid != uid or info.st_gid != gid:
+                os.lchown(path, uid, gid)
+    except (KeyError, OSError):
         raise RuntimeError("Unable to repair permissions: '/var/db/locationd'!")
 
     launchctl = [
@@ -354,11 +491,27 @@ def enable():
 
     output = subprocess.check_output(
         launchctl,
-        stderr=subprocess.STDOUT
+        stderr=subprocess.STDOUT,
+        universal_newlines=True
     ).strip('\n')
 
     return output
 
+def _tree(top):
+    """
+    Yields the path of every file and directory under 'top' (including 'top'
+    itself) without following symbolic links.
+
+    :param top: the directory to walk
+    """
+    def error(e):
+        raise e
+
+    yield top
+    for root, dirs, files in os.walk(top, onerror=error):
+        for name in dirs + files:
+            yield os.path.join(root, name)
+
 def disable():
     """
     Unload the locationd launchd daemon item.
@@ -371,7 +524,8 @@ def disable():
 
     output = subprocess.check_output(
         launchctl,
-        stderr=subprocess.STDOUT
+        stderr=subprocess.STDOUT,
+        universal_newlines=True
     ).strip('\n')
 
     return output
@@ -1,13 +1,7 @@
 import os
 import sqlite3
-import universal
 
-try:
-    from management_tools.app_info import AppInfo
-except ImportError as e:
-    print("You need version 1.6.0 or greater of the 'Management Tools' module to be installed first.")
-    print("https://github.com/univ-of-utah-marriott-library-apple/management_tools")
-    raise e
+from .location_services import _darwin_version
 
 # The services have particular names and databases.
 # The tuplet is (Service Name, TCC database, Darwin version introduced)
@@ -19,6 +13,77 @@ available_services = {
     'reminders':     ('kTCCServiceReminders',     'local', 13)
 }
 
+# The statements used to build a fresh TCC database. These databases have a
+# very particular format which depends on the version of OS X, so the right
+# statements for this system are worked out once here - don't change this!
+_tcc_statements = ["CREATE TABLE admin (key TEXT PRIMARY KEY NOT NULL, value INTEGER NOT NULL)"]
+
+if _darwin_version < 15:
+    _tcc_statements.append("INSERT INTO admin VALUES ('version', 7)")
+else:
+    _tcc_statements.append("INSERT INTO admin VALUES ('version', 8)")
+
+# This table's formatting is version-sensitive.
+_access_table = (
+    "CREATE TABLE access "
+    "(service TEXT NOT NULL, "
+    "client TEXT NOT NULL, "
+    "client_type INTEGER NOT NULL, "
+    "allowed INTEGER NOT NULL, "
+    "prompt_count INTEGER NOT NULL, "
+)
+if _darwin_version > 12:
+    _access_table += "csreq BLOB, "
+if _darwin_version >= 15:
+    _access_table += (
+        "policy_id INTEGER, "
+        "PRIMARY KEY (service, client, client_type), "
+        "FOREIGN KEY (policy_id) REFERENCES policies(id) "
+        "ON DELETE CASCADE "
+        "ON UPDATE CASCADE)"
+    )
+else:
+    _access_table += "CONSTRAINT key PRIMARY KEY (service, client, client_type))"
+_tcc_statements.append(_access_table)
+
+_tcc_statements.append(
+    "CREATE TABLE access_times "
+    "(service TEXT NOT NULL, "
+    "client TEXT NOT NULL, "
+    "client_type INTEGER NOT NULL, "
+    "last_used_time INTEGER NOT NULL, "
+    "CONSTRAINT key PRIMARY KEY (service, client, client_type))"
+)
+_tcc_statements.append(
+    "CREATE TABLE access_overrides "
+    "(service TEXT PRIMARY KEY NOT NULL)"
+)
+
+if _darwin_version >= 15:
+    # There are some extra tables to add.
+    _tcc_statements.append(
+        "CREATE TABLE policies "
+        "(id INTEGER NOT NULL PRIMARY KEY, "
+        "bundle_id TEXT NOT NULL, "
+        "uuid TEXT NOT NULL, "
+        "display TEXT NOT NULL, "
+        "UNIQUE (bundle_id, uuid))"
+    )
+    _tcc_statements.append(
+        "CREATE TABLE active_policy "
+        "(client TEXT NOT NULL, "
+        "client_type INTEGER NOT NULL, "
+        "policy_id INTEGER NOT NULL, "
+        "PRIMARY KEY (client, client_type), "
+        "FOREIGN KEY (policy_id) REFERENCES policies(id) "
+        "ON DELETE CASCADE "
+        "ON UPDATE CASCADE)"
+    )
+    _tcc_statements.append("CREATE INDEX active_policy_id ON active_policy(policy_id)")
+
+# All of the statements are run together as one script.
+_tcc_schema = ";\n".join(_tcc_statements) + ";"
+
 class TCCEdit(object):
     """
     Provides a class for modifying the Privacy Services permissions. This class
@@ -67,14 +132,26 @@ class TCCEdit(object):
 
         # Check the version of OS X before continuing; only Darwin versions 12
         # and above support the TCC database system.
-        try:
-            version = int(os.uname()[2].split('.')[0])
-        except:
+        version = _darwin_version
+        if not version:
             raise RuntimeError("Could not acquire the OS X version.")
         if version < 12:
             raise RuntimeError("No TCC functionality on this version of OS X.")
         self.version = version
 
+        # The shape of the 'access' table depends on the version of OS X, so
+        # the statement that adds entries to it is settled once here.
+        # Prior to OS X 10.8 (Darwin 12) there was no TCC database.
+        # In OS X 10.9 (Darwin 13) Apple added a 'csreq' field.
+        # In OS X 10.11 (Darwin 15) Apple added a 'policy_id' field.
+        if self.version == 12:
+            extra_columns = ''
+        elif self.version < 15:
+            extra_columns = ', NULL'
+        else:
+            extra_columns = ', NULL, NULL'
+        self.__insert_sql = 'INSERT or REPLACE into access values(?, ?, ?, 1, 0{})'.format(extra_columns)
+
         # Establish database locations.
         local_log_entry = ''
         if template:
@@ -132,7 +209,7 @@ command with the `--forceroot` option:
                 raise ValueError("Invalid username supplied: {}".format(self.user))
 
         if self.local_path:
-            self.logger.info(local_log_entry + "'" + self.local_path + "'.")
+            self.logger.info("{}'{}'.".format(local_log_entry, self.local_path))
         self.root_path = '/Library/Application Support/com.apple.TCC/TCC.db'
         self.logger.info("Set to modify global permissions for all users at '{}'.".format(self.root_path))
 
@@ -160,6 +237,10 @@ command with the `--forceroot` option:
             self.local = None
         self.connections = {'root': self.root, 'local': self.local}
 
+        # Bundle identifiers that have already been looked up, keyed by the
+        # target they were found from.
+        self.bids = {}
+
     def insert(self, target, service=None):
         """
         Enable the specified target for the given service.
@@ -181,13 +262,13 @@ command with the `--forceroot` option:
             else:
                 raise ValueError("Using no-check administrative override without a specified no-check type.")
         else:
-            target = AppInfo(target).bid
+            target = self.__resolve(target)
             client_type = 0
         
         # If the service was not specified, get the original.
-        if service is None and self.service:
+        if service is None:
             service = self.service
-        else:
+        if not service:
             return
 
         # Don't beat up the user for doing something like "AcCeSsIbILITy".
@@ -195,18 +276,20 @@ command with the `--forceroot` option:
 
         # Check that the service is known to the program; I do not intend to
         # support unsupported services here.
-        if not service in available_services.keys():
+        entry = available_services.get(service)
+        if entry is None:
             raise ValueError("Invalid service provided: {}".format(service))
+        service_name, database, introduced = entry
 
         # Version checking for the current service.
-        if self.version < available_services[service][2]:
+        if self.version < introduced:
             raise RuntimeError("Service '{}' does not exist on this version of OS X.".format(service))
 
         # Proceed.
         self.logger.info("Inserting '{}' in service '{}'...".format(target, service))
 
         # Establish a connection with the TCC database.
-        connection = self.connections[available_services[service][1]]
+        connection = self.connections[database]
 
         # Clearly you tried to modify something you weren't supposed to!
         # For shame.
@@ -219,17 +302,8 @@ command with the `--forceroot` option:
         c = connection.cursor()
 
         # Add the entry!
-        # Prior to OS X 10.8 (Darwin 12) there was no TCC database.
-        # In OS X 10.9 (Darwin 13) Apple added a 'csreq' field.
-        # In OS X 10.11 (Darwin 15) Apple added a 'policy_id' field.
-        values = (available_services[service][0], target, client_type)
-        if self.version == 12:
-            c.execute('INSERT or REPLACE into access values(?, ?, ?, 1, 0)', values)
-        elif 15 > self.version > 12:
-            c.execute('INSERT or REPLACE into access values(?, ?, ?, 1, 0, NULL)', values)
-        elif self.version >= 15:
-            c.execute('INSERT or REPLACE into access values(?, ?, ?, 1, 0, NULL, NULL)', values)
-        connection.commit()
+        values = (service_name, target, client_type)
+        c.execute(self.__insert_sql, values)
 
         self.logger.info("Inserted successfully.")
 
@@ -246,25 +320,27 @@ command with the `--forceroot` option:
         
         # If not using admin override mode, look up a bundle identifier.
         if not self.no_check:
-            target = AppInfo(target).bid
+            target = self.__resolve(target)
         
         # If the service was not specified, get the original.
-        if service is None and self.service:
+        if service is None:
             service = self.service
-        else:
+        if not service:
             return
 
         # Be nice to the user.
         service = service.lower()
 
         # Check the service is recognized.
-        if not service in available_services.keys():
-            raise ValueError("Invalid service provided: " + service)
+        entry = available_services.get(service)
+        if entry is None:
+            raise ValueError("Invalid service provided: {}".format(service))
+        service_name, database, introduced = entry
 
         self.logger.info("Removing '{}' from service '{}'...".format(target, service))
 
         # Establish a connection with the TCC database.
-        connection = self.connections[available_services[service][1]]
+        connection = self.connections[database]
 
         # Validate that the connection was successful.
         if not connection:
@@ -273,17 +349,16 @@ command with the `--forceroot` option:
         c = connection.cursor()
 
         # Perform the deletion.
-        values = (available_services[service][0], target)
-        c.execute('DELETE FROM access WHERE service IS ? AND client IS ?', values)
-        connection.commit()
+        values = (service_name, target)
+        c.execute('DELETE FROM access WHERE service = ? AND client = ?', values)
 
         self.logger.info("Removed successfully.")
 
     def disable(self, target, service=None):
         """
         Mark the application or file as being disallowed from utilizing Privacy
-        Services. If the target is not already in the database, it will be added
-        and then disabled.
+        Services. Only targets which already have an entry in the database are
+        modified.
 
         :param target: an application or file to modify permissions for
         :param service: the service to modify
@@ -293,35 +368,28 @@ command with the `--forceroot` option:
             return
         
         # If not using admin override mode, look up a bundle identifier.
-        if self.no_check:
-            # We get the client type from the no_check_type.
-            if self.type == 'bin':
-                client_type = 1
-            elif self.type == 'app':
-                client_type = 0
-            else:
-                raise ValueError("Using no-check administrative override without a specified no-check type.")
-        else:
-            target = AppInfo(target).bid
-            client_type = 0
+        if not self.no_check:
+            target = self.__resolve(target)
         
         # If the service was not specified, get the original.
-        if service is None and self.service:
+        if service is None:
             service = self.service
-        else:
+        if not service:
             return
 
         # Be nice to the user.
         service = service.lower()
 
         # Check the service is recognized.
-        if not service in available_services.keys():
+        entry = available_services.get(service)
+        if entry is None:
             raise ValueError("Invalid service provided: {}".format(service))
+        service_name, database, introduced = entry
 
         self.logger.info("Disabling '{}' in service '{}'...".format(target, service))
 
         # Establish a connection with the TCC database.
-        connection = self.connections[available_services[service][1]]
+        connection = self.connections[database]
 
         # Validate that the connection was successful.
         if not connection:
@@ -332,20 +400,29 @@ command with the `--forceroot` option:
         # Disable the application for the given service.
         # The 'prompt_count' must be 1 or else the system will ask the user
         # anyway. This is the only time it seems to really matter.
-        values = (available_services[service][0], target, client_type)
-        c.execute('SELECT count(*) FROM access WHERE service IS ? and client IS ?', values[0:2])
-        count = c.fetchone()[0]
-        if count:
-            if self.version == 12:
-                c.execute('INSERT or REPLACE into access values(?, ?, ?, 0, 1)', values)
-            elif 15 > self.version > 12:
-                c.execute('INSERT or REPLACE into access values(?, ?, ?, 0, 1, NULL)', values)
-            elif self.version >= 15:
-                c.execute('INSERT or REPLACE into access values(?, ?, ?, 0, 1, NULL, NULL)', values)
-        connection.commit()
+        # Only existing entries are modified, so this is done with a single
+        # UPDATE rather than checking for the entry first.
+        values = (service_name, target)
+        c.execute('UPDATE access SET allowed = 0, prompt_count = 1 WHERE service = ? AND client = ?', values)
+        if not c.rowcount:
+            self.logger.info("'{}' has no entry in service '{}'; nothing to disable.".format(target, service))
+            return
 
         self.logger.info("Disabled successfully.")
 
+    def __resolve(self, target):
+        """
+        Finds the bundle identifier for the given target. Lookups are cached, so
+        each target only has to be found once per editor.
+
+        :param target: an application name, bundle identifier, or path
+        :return: the application's bundle identifier
+        """
+        if target not in self.bids:
+            from management_tools.app_info import AppInfo
+            self.bids[target] = AppInfo(target).bid
+        return self.bids[target]
+
     def __create(self, path):
         """
         Creates a fresh TCC database at the given path.
@@ -394,77 +471,10 @@ command with the `--forceroot` option:
                 # make the parent directories as needed and ignore permissions.
                 os.makedirs(os.path.dirname(path), int('700', 8))
 
-        # Form an SQL connection with the file.
+        # Form an SQL connection with the file and create the tables. (The
+        # script is committed as it's run.)
         connection = sqlite3.connect(path)
-        c = connection.cursor()
-
-        # Create the tables.
-        c.execute("CREATE TABLE admin (key TEXT PRIMARY KEY NOT NULL, value INTEGER NOT NULL)")
-
-        if self.version < 15:
-            c.execute("INSERT INTO admin VALUES ('version', 7)")
-        else:
-            c.execute("INSERT INTO admin VALUES ('version', 8)")
-
-        # This table's formatting is version-sensitive.
-        access_table = (
-            "CREATE TABLE access "
-            "(service TEXT NOT NULL, "
-            "client TEXT NOT NULL, "
-            "client_type INTEGER NOT NULL, "
-            "allowed INTEGER NOT NULL, "
-            "prompt_count INTEGER NOT NULL, "
-        )
-        if self.version > 12:
-            access_table += "csreq BLOB, "
-        if self.version >= 15:
-            access_table += (
-                "policy_id INTEGER, "
-                "PRIMARY KEY (service, client, client_type), "
-                "FOREIGN KEY (policy_id) REFERENCES policies(id) "
-                "ON DELETE CASCADE "
-                "ON UPDATE CASCADE)"
-            )
-        else:
-            access_table += "CONSTRAINT key PRIMARY KEY (service, client, client_type))"
-        c.execute(access_table)
-
-        c.execute(
-                "CREATE TABLE access_times "
-                "(service TEXT NOT NULL, "
-                "client TEXT NOT NULL, "
-                "client_type INTEGER NOT NULL, "
-                "last_used_time INTEGER NOT NULL, "
-                "CONSTRAINT key PRIMARY KEY (service, client, client_type))"
-        )
-        c.execute(
-                "CREATE TABLE access_overrides "
-                "(service TEXT PRIMARY KEY NOT NULL)"
-        )
-        
-        if self.version >= 15:
-            # There are some extra tables to add.
-            c.execute(
-                "CREATE TABLE policies "
-                "(id INTEGER NOT NULL PRIMARY KEY, "
-                "bundle_id TEXT NOT NULL, "
-                "uuid TEXT NOT NULL, "
-                "display TEXT NOT NULL, "
-                "UNIQUE (bundle_id, uuid))"
-            )
-            c.execute(
-                "CREATE TABLE active_policy "
-                "(client TEXT NOT NULL, "
-                "client_type INTEGER NOT NULL, "
-                "policy_id INTEGER NOT NULL, "
-                "PRIMARY KEY (client, client_type), "
-                "FOREIGN KEY (policy_id) REFERENCES policies(id) "
-                "ON DELETE CASCADE "
-                "ON UPDATE CASCADE)"
-            )
-            c.execute("CREATE INDEX active_policy_id ON active_policy(policy_id)")
-
-        connection.commit()
+        connection.executescript(_tcc_schema)
         connection.close()
 
         self.logger.info("TCC.db file created successfully.")
@@ -483,9 +493,11 @@ command with the `--forceroot` option:
         """
         Allows for the TCCEdit object to be used in a 'with' clause.
         
-        Properly closes all connections when the item is trashed.
+        All of the changes made through this editor are committed here in a
+        single transaction per database (instead of one per change), and then
+        the connections are properly closed.
         """
-        if self.root:
-            self.root.close()
-        if self.local:
-            self.local.close()
+        for connection in (self.root, self.local):
+            if connection:
+                connection.commit()
+                connection.close()
@@ -1,5 +1,5 @@
-import location_services
-import tcc_services
+from . import location_services
+from . import tcc_services
 
 # Common attributes of the module and script.
 attributes = {
@@ -10,7 +10,7 @@ attributes = {
 
 # This is a list of services which can be modified.
 # Useful for scripts to call on for a neat list.
-available_services = tcc_services.available_services.keys() + ['location']
+available_services = list(tcc_services.available_services) + ['location']
 
 def get_editor(service, logger, user='', template=False, lang='English', forceroot=False, no_check=False, no_check_type=None):
     """
@@ -21,9 +21,9 @@ def get_editor(service, logger, user='', template=False, lang='English', forcero
 
     # Only return something if we have an editor for it!
     if service not in available_services:
-        raise ValueError("Invalid service: " + str(service))
+        raise ValueError("Invalid service: {}".format(service))
     else:
-        if service in tcc_services.available_services.keys():
+        if service in tcc_services.available_services:
             # If it's in the TCC services, return a pre-formatted one of those.
             return tcc_services.TCCEdit(
                 service         = service,
@@ -1,19 +1,27 @@
 #!/usr/bin/env python
 
-import argparse
-import privacy_services_management as psm
+import os
 import sys
 
 # Check that management_tools is installed.
 try:
     from management_tools import loggers
-    from management_tools.app_info import AppInfo
 except ImportError as e:
     print("You need version 1.6.0 or greater of the 'Management Tools' module to be installed first.")
     print("https://github.com/univ-of-utah-marriott-library-apple/management_tools")
     raise e
 
+# The editor method which carries out each action.
+editor_methods = {
+    'add':     'insert',
+    'enable':  'insert',
+    'remove':  'remove',
+    'disable': 'disable',
+}
+
 def main(apps, service, action, user, template, language, logger, forceroot, no_check, no_check_type):
+    import privacy_services_management as psm
+
     # Output some information.
     output = '#' * 80 + '\n' + version() + '''
     service:  {service}
@@ -38,9 +46,9 @@ def main(apps, service, action, user, template, language, logger, forceroot, no_
 )
     logger.info(output, print_out = False)
 
-    # Do the actual modifying of the services.
-    if len(apps) == 0:
-        apps.append(None)
+    # Do the actual modifying of the services. Empty application names are
+    # dropped up front; if nothing is left, the service itself is modified.
+    apps = [app for app in apps if app] or [None]
     with psm.universal.get_editor(
         service         = service,
         logger          = logger,
@@ -51,17 +59,12 @@ def main(apps, service, action, user, template, language, logger, forceroot, no_
         no_check        = no_check,
         no_check_type   = no_check_type,
     ) as e:
-        if action == 'add' or action == 'enable':
-            for app in apps:
-                e.insert(app)
-        elif action == 'remove':
+        if action in editor_methods:
+            modify = getattr(e, editor_methods[action])
             for app in apps:
-                e.remove(app)
-        elif action == 'disable':
-            for app in apps:
-                e.disable(app)
+                modify(app)
         else:
-            logger.error("Invalid action '" + action + "'.")
+            logger.error("Invalid action '{}'.".format(action))
 
     # Notify of successful completion.
     logger.info("Successfully completed.")
@@ -70,21 +73,17 @@ def version():
     """
     :return: the version information for this program
     """
+    import privacy_services_management as psm
+
     return (
         "{name}, version {version}\n".format(
         name=psm.universal.attributes['long_name'],
         version=psm.universal.attributes['version'])
     )
 
-def usage(short=False):
-    """
-    Prints out usage information.
-    """
-
-    if not short:
-        print(version())
-
-    print('''\
+# The text of the help message. The short part is shown alongside errors; the
+# full message adds the long part.
+short_usage = '''\
 usage: {name} [-hvn] [-l log] [-u user]
          [--template] [--language] action service applications
 
@@ -120,10 +119,9 @@ Accessibility, Calendars, Reminders, and Locations.
     --language lang
         Only functions when used with --template. Specifies which User Template
         is modified.\
-'''.format(name=psm.universal.attributes['name']))
+'''
 
-    if not short:
-        print('''
+long_usage = '''
 ACTION
     add
         Adds applications to the service and enable them.
@@ -175,21 +173,187 @@ APPLICATIONS
     3. Bundle path location
             The absolute path to an application's .app bundle.
                 e.g. /Applications/Safari.app\
-''')
+'''
 
-class ArgumentParser(argparse.ArgumentParser):
+def usage(short=False):
     """
-    Custom argument parser for handling error messages nicely.
+    Prints out usage information.
     """
-    def error(self, message):
-        print("Error: {}\n".format(message))
-        usage(short=True)
-        self.exit(2)
+    import privacy_services_management as psm
+
+    # The whole message is written out at once.
+    text = short_usage.format(name=psm.universal.attributes['name']) + '\n'
+    if not short:
+        text = version() + '\n' + text + long_usage + '\n'
+    sys.stdout.write(text)
+
+def parse_error(message):
+    """
+    Reports a problem with the command line, prints the short usage, and quits.
+
+    :param message: a description of the problem
+    """
+    print("Error: {}\n".format(message))
+    usage(short=True)
+    sys.exit(2)
+
+class Arguments(object):
+    """
+    Holds the parsed command line. Every option starts out with its default.
+    """
+    help         = False
+    version      = False
+    no_log       = False
+    log_dest     = None
+    user         = ''
+    template     = False
+    language     = 'English'
+    forceroot    = False
+    no_check_app = False
+    no_check_bin = False
+    action       = None
+    service      = None
+
+    def __init__(self):
+        self.apps = []
+
+# Options which take no value, and the attribute each one sets.
+flag_options = {
+    '-h':             'help',
+    '--help':         'help',
+    '-v':             'version',
+    '--version':      'version',
+    '-n':             'no_log',
+    '--no-log':       'no_log',
+    '--template':     'template',
+    '--forceroot':    'forceroot',
+    '--no-check-app': 'no_check_app',
+    '--no-check-bin': 'no_check_bin',
+    '--admin':        'no_check_bin',
+}
+
+# Options which take a value, and the attribute the value is stored in.
+value_options = {
+    '-l':         'log_dest',
+    '--log-dest': 'log_dest',
+    '-u':         'user',
+    '--user':     'user',
+    '--language': 'language',
+}
+
+def long_option(name):
+    """
+    Expands an abbreviated long option (e.g. '--lang' for '--language'), the
+    same as argparse does. An abbreviation matching more than one option is an
+    error.
+
+    :param name: the option as it was given
+    :return: the full option name, or 'name' itself if nothing matches
+    """
+    if name in flag_options or name in value_options:
+        return name
+    matches = sorted(
+        option for option in list(flag_options) + list(value_options)
+        if option.startswith('--') and option.startswith(name)
+    )
+    if len(matches) > 1:
+        parse_error("ambiguous option: {} could match {}".format(name, ', '.join(matches)))
+    if matches:
+        return matches[0]
+    return name
+
+def parse_arguments(argv):
+    """
+    Parses the command line.
+
+    The grammar is small and fixed, so this is done by hand rather than by
+    argparse, which costs more to import and set up than the whole parse.
+    As with the argparse version, everything after the service is taken as an
+    application, even if it looks like an option.
+
+    :param argv: the command line arguments, without the program name
+    :return: an Arguments object
+    """
+    args = Arguments()
+    positionals = []
+    i = 0
+    while i < len(argv) and len(positionals) < 2:
+        arg = argv[i]
+        i += 1
+
+        if arg == '--':
+            # Everything from here on is positional.
+            positionals.extend(argv[i:])
+            i = len(argv)
+        elif arg.startswith('--'):
+            name, equals, value = arg.partition('=')
+            name = long_option(name)
+            if name in flag_options and not equals:
+                setattr(args, flag_options[name], True)
+            elif name in value_options:
+                if not equals:
+                    if i >= len(argv):
+                        parse_error("argument {}: expected one argument".format(name))
+                    value = argv[i]
+                    i += 1
+                setattr(args, value_options[name], value)
+            else:
+                parse_error("unrecognized arguments: {}".format(arg))
+        elif arg.startswith('-') and len(arg) > 1:
+            # Short options may be grouped (e.g. '-hvn'), and a value may be
+            # attached directly to the last one (e.g. '-uname').
+            for j in range(1, len(arg)):
+                name = '-' + arg[j]
+                if name in flag_options:
+                    setattr(args, flag_options[name], True)
+                elif name in value_options:
+                    value = arg[j + 1:]
+                    # Like argparse, '-u=name' means '-u name' (but only when
+                    # the option isn't grouped after others).
+                    if j == 1 and value.startswith('='):
+                        value = value[1:]
+                    elif not value:
+                        if i >= len(argv):
+                            parse_error("argument {}: expected one argument".format(name))
+                        value = argv[i]
+                        i += 1
+                    setattr(args, value_options[name], value)
+                    break
+                else:
+                    parse_error("unrecognized arguments: {}".format(arg))
+        else:
+            positionals.append(arg)
+
+    # After the action and service, the rest are all applications. (A '--'
+    # directly after the service only marks where they start.)
+    rest = argv[i:]
+    if rest[:1] == ['--']:
+        rest = rest[1:]
+    args.apps = positionals[2:] + rest
+    if positionals:
+        args.action = positionals[0]
+    if len(positionals) > 1:
+        args.service = positionals[1]
+
+    return args
+
+def parse_arguments_argparse(argv):
+    """
+    Parses the command line with argparse. This is only used when the
+    PSM_ARGPARSE environment variable is set.
+
+    :param argv: the command line arguments, without the program name
+    :return: an argparse.Namespace with the same attributes as Arguments
+    """
+    import argparse
+
+    class ArgumentParser(argparse.ArgumentParser):
+        """
+        Custom argument parser for handling error messages nicely.
+        """
+        def error(self, message):
+            parse_error(message)
 
-#---------------------#
-# Program Entry Point #
-#---------------------#
-if __name__ == '__main__':
     # Create an argument parser and the valid arguments.
     parser = ArgumentParser(add_help=False)
     parser.add_argument('-h', '--help', action='store_true')
@@ -203,15 +367,24 @@ if __name__ == '__main__':
     parser.add_argument('--no-check-app', action='store_true')
     parser.add_argument('--no-check-bin', action='store_true')
     parser.add_argument('--admin', action='store_true', dest='no_check_bin')
-    parser.add_argument('action', nargs='?',
-                        choices=['add', 'remove', 'enable', 'disable'],
-                        default=None)
-    parser.add_argument('service', nargs='?',
-                        choices=psm.universal.available_services)
+    parser.add_argument('action', nargs='?', default=None)
+    parser.add_argument('service', nargs='?')
     parser.add_argument('apps', nargs=argparse.REMAINDER)
-    
+
+    return parser.parse_args(argv)
+
+#---------------------#
+# Program Entry Point #
+#---------------------#
+def cli():
+    """
+    Runs the program from the command line.
+    """
     # Parse the arguments.
-    args = parser.parse_args()
+    if os.environ.get('PSM_ARGPARSE'):
+        args = parse_arguments_argparse(sys.argv[1:])
+    else:
+        args = parse_arguments(sys.argv[1:])
 
     # Print help information and quit.
     if args.help:
@@ -220,9 +393,28 @@ if __name__ == '__main__':
     
     # Print version information and quit.
     if args.version:
-        print(version())
+        sys.stdout.write(version() + '\n')
         sys.exit(0)
 
+    # Perform checks for necessary bits of information. This is all done
+    # before the logger is set up, so a bad invocation doesn't open any logs.
+    if not args.action:
+        sys.stderr.write("Error: Must specify an action.\n")
+        sys.exit(1)
+    if not args.service:
+        sys.stderr.write("Error: Must specify a service to modify.\n")
+        sys.exit(1)
+    if args.no_check_app and args.no_check_bin:
+        parse_error("Cannot give both --no-check-app and --no-check-bin.")
+
+    # The action and service are validated here instead of by the parser, so
+    # that the package is only imported once it's actually needed.
+    if args.action not in editor_methods:
+        parse_error("Invalid action '{}'.".format(args.action))
+    import privacy_services_management as psm
+    if args.service not in psm.universal.available_services:
+        parse_error("Invalid service '{}'.".format(args.service))
+
     # Set up the logger.
     logger = loggers.get_logger(
         name = psm.universal.attributes['name'],
@@ -237,9 +429,6 @@ if __name__ == '__main__':
     template  = args.template
     language  = args.language
     
-    if args.no_check_app and args.no_check_bin:
-        parser.error("Cannot give both --no-check-app and --no-check-bin.")
-    
     if args.no_check_app:
         no_check = True
         no_check_type = 'app'
@@ -271,15 +460,6 @@ if __name__ == '__main__':
         language = language if template else "N/A"
     )
     
-    # Perform checks for necessary bits of information.
-    if not args.action:
-        print("Error: Must specify an action.")
-        logger.error(output)
-        sys.exit(1)
-    if not args.service:
-        print("Error: Must specify a service to modify.")
-        logger.error(output)
-        sys.exit(1)
     if args.no_check_bin or args.no_check_app:
         logger.warn("Administrative override enabled. Be careful!")
         
@@ -298,10 +478,9 @@ if __name__ == '__main__':
             no_check        = no_check,
             no_check_type   = no_check_type
         )
-    except:
-        message = (
-            str(sys.exc_info()[0].__name__) + ": " +
-            str(sys.exc_info()[1].message)
-        )
-        logger.error(message)
+    except Exception as e:
+        logger.error("{}: {}".format(type(e).__name__, e))
         sys.exit(3)
+
+if __name__ == '__main__':
+    cli()